@@ -1,20 +1,29 @@
 #!/usr/bin/env python3
 """
 Scheduler to sync location data between Geotab and Ruckit APIs
-Runs every 2 minutes to check for location discrepancies
+Polls every 1-10 minutes (adaptive, starting at 2) to check for location discrepancies
 """
 
 import time
 import threading
-import requests
-import json
+import asyncio
+import aiohttp
+import orjson
+import numpy as np
 import mygeotab
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import os
+import logging
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 class LocationSyncScheduler:
+    # Template values left in AddInData records that haven't been configured yet
+    PLACEHOLDER_VALUES = frozenset({'TOKEN', 'DriverID', 'DeviceID'})
+    
     def __init__(self, geotab_username: str, geotab_database: str, geotab_password: str):
         """
         Initialize the scheduler with Geotab credentials
@@ -28,11 +37,68 @@ class LocationSyncScheduler:
         self.geotab_database = geotab_database
         self.geotab_password = geotab_password
         self.geotab_api = None
+        self.session = None
+        self.ruckit_semaphore = None
         self.running = False
         self.scheduler_thread = None
+        self._scheduler_loop = None  # event loop of the running scheduler thread
+        self._stop_event = None  # set from stop() to wake the scheduler out of its sleep
         
         # Ruckit API endpoints
         self.URL_UPDATES = 'https://ruckit-platform.herokuapp.com/api/locationupdates/'
+        
+        # Adaptive polling interval (seconds): reset to the minimum when discrepancies are found,
+        # doubled up to the maximum while everything matches
+        self.SYNC_INTERVAL = 120
+        self.SYNC_INTERVAL_MIN = 60
+        self.SYNC_INTERVAL_MAX = 600
+        
+        # Max per-axis difference (degrees) for Geotab and Ruckit coordinates to count as matching
+        self.COORDINATE_TOLERANCE = 0.0001
+        
+        # AddInData queries: the filtered clause drops placeholder records server-side;
+        # the plain clause is the fallback if Geotab rejects queries on details fields
+        self.ADD_IN_DATA_WHERE = 'type = "ri-device"'
+        self.ADD_IN_DATA_FILTERED_WHERE = (
+            'type = "ri-device" AND details.ri-token != "TOKEN" '
+            'AND details.ri-driver != "DriverID" AND details.ri-device != "DeviceID"'
+        )
+        self.add_in_data_filter_supported = True
+        
+        # Geotab error names assumed to mean the request itself was rejected (unsupported query or
+        # argument). The list is a best guess, so an optional query is also given up after failing
+        # this many cycles in a row while the equivalent plain query succeeds.
+        self.GEOTAB_REJECTION_ERRORS = frozenset({
+            'ArgumentException', 'ArgumentOutOfRangeException', 'ArgumentNullException',
+            'InvalidCastException', 'NotSupportedException', 'JsonSerializerException'
+        })
+        self.GEOTAB_UNSUPPORTED_AFTER = 3
+        self._add_in_data_filter_failures = 0
+        
+        # Ruckit mapping cached across cycles and updated from the AddInData feed. The feed
+        # doesn't report deleted records, so the mapping is fully reloaded at least once per
+        # max poll interval.
+        self.MAPPING_FULL_REFRESH = self.SYNC_INTERVAL_MAX
+        self.add_in_data_feed_supported = True
+        self._add_in_data_feed_failures = 0
+        self._mapping_entries: Dict[str, Tuple[str, Dict]] = {}  # AddInData id -> (gt-device, Ruckit info)
+        self._mapping_version = None
+        self._mapping_loaded_at = 0.0
+        self.device_mapping: Dict[str, Dict] = {}
+        
+        # Ruckit HTTP settings: connect/read timeouts and retry policy for transient gateway errors
+        self.RUCKIT_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3.05, sock_read=10)
+        self.RUCKIT_MAX_RETRIES = 3
+        self.RUCKIT_RETRY_BACKOFF = 0.3
+        self.RUCKIT_RETRY_STATUSES = {502, 503, 504}
+        self.RUCKIT_MAX_CONCURRENCY = 16  # in-flight Ruckit requests, to stay within rate limits
+        
+        # Last known Ruckit coordinates keyed by ri_driver: (fetched_at, (longitude, latitude)).
+        # A fetch is skipped while Geotab still matches the cached position; the TTL bounds how
+        # long that position is trusted before Ruckit is re-read (e.g. to catch other writers).
+        self.RUCKIT_CACHE_TTL = self.SYNC_INTERVAL_MAX  # seconds; never trust it longer than one max poll
+        self._ruckit_cache: Dict[str, Tuple[float, Tuple[float, float]]] = {}
+        self._header_cache: Dict[str, Dict[str, str]] = {}  # ri_token -> request headers
     
     def authenticate_geotab(self):
         """Authenticate with the MyGeotab API"""
@@ -43,102 +109,254 @@ class LocationSyncScheduler:
                 database=self.geotab_database
             )
             self.geotab_api.authenticate()
-            print(f"Authenticated with Geotab successfully for database: {self.geotab_database}")
+            logger.info("Authenticated with Geotab successfully for database: %s", self.geotab_database)
             return True
         except Exception as e:
-            print(f"Failed to authenticate with Geotab: {e}")
+            logger.error("Failed to authenticate with Geotab: %s", e)
             return False
     
+    async def run_blocking(self, func, *args):
+        """
+        Run a blocking call (e.g. the synchronous MyGeotab SDK) on a worker thread
+        
+        Args:
+            func: Callable to run
+            *args: Positional arguments for the callable
+            
+        Returns:
+            The callable's return value
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+    
     def get_geotab_data(self, type_name: str, **kwargs):
         """Wrapper for Geotab API calls"""
         try:
-            print(f"Calling Geotab API for type: {type_name}")
+            logger.debug("Calling Geotab API for type: %s", type_name)
             return self.geotab_api.call("Get", typeName=type_name, **kwargs)
+        except mygeotab.exceptions.AuthenticationException:
+            # Let the scheduler re-authenticate and retry the cycle
+            raise
         except Exception as e:
-            print(f"Error calling Geotab API for {type_name}: {e}")
+            logger.error("Error calling Geotab API for %s: %s", type_name, e)
             return None
     
+    def is_geotab_rejection(self, error: Exception) -> bool:
+        """
+        Check if a Geotab error means the request is unsupported rather than transiently failing
+        
+        Args:
+            error: Exception raised by a MyGeotab call
+            
+        Returns:
+            True if Geotab rejected the query or its arguments
+        """
+        return (isinstance(error, mygeotab.exceptions.MyGeotabException)
+                and error.name in self.GEOTAB_REJECTION_ERRORS)
+    
     def get_device_status_info(self) -> List[Dict]:
         """Get device status information from Geotab"""
         return self.get_geotab_data("DeviceStatusInfo") or []
     
-    def get_add_in_data(self) -> List[Dict]:
-        """Get AddInData from Geotab containing Ruckit mapping info"""
-        search_params = {
-            'whereClause': 'type = "ri-device"'
-        }
-        return self.get_geotab_data("AddInData", search=search_params) or []
+    def get_add_in_data(self) -> Optional[List[Dict]]:
+        """
+        Get AddInData from Geotab containing Ruckit mapping info
+        
+        Returns:
+            AddInData records, or None if the query failed
+        """
+        filter_failed = False
+        if self.add_in_data_filter_supported:
+            try:
+                logger.debug("Calling Geotab API for type: AddInData (placeholder filter)")
+                add_in_data = self.geotab_api.call("Get", typeName="AddInData",
+                                                   search={'whereClause': self.ADD_IN_DATA_FILTERED_WHERE}) or []
+                self._add_in_data_filter_failures = 0
+                return add_in_data
+            except mygeotab.exceptions.AuthenticationException:
+                raise
+            except Exception as e:
+                if self.is_geotab_rejection(e):
+                    logger.warning("Geotab rejected the placeholder filter (%s); using the type-only AddInData query", e.name)
+                    self.add_in_data_filter_supported = False
+                else:
+                    # Possibly transient: use the plain query this cycle and try the filter again next time
+                    logger.error("Error calling Geotab API for AddInData: %s", e)
+                    filter_failed = True
+        
+        add_in_data = self.get_geotab_data("AddInData", search={'whereClause': self.ADD_IN_DATA_WHERE})
+        if filter_failed and add_in_data is not None:
+            self._add_in_data_filter_failures += 1
+            if self._add_in_data_filter_failures >= self.GEOTAB_UNSUPPORTED_AFTER:
+                logger.warning("Placeholder filter failed %d cycles in a row while the plain query worked; "
+                               "using the type-only AddInData query", self._add_in_data_filter_failures)
+                self.add_in_data_filter_supported = False
+        return add_in_data
     
-    def get_ruckit_location_updates(self, ri_token: str, ri_driver: str) -> Optional[Dict]:
+    def get_add_in_data_feed(self, from_version: Optional[str]) -> Optional[Dict]:
         """
-        Get last location updates for a driver from Ruckit API
+        Get AddInData records changed since a feed version from Geotab
         
         Args:
-            ri_token: Ruckit API token
-            ri_driver: Ruckit driver ID
+            from_version: Version returned by the previous feed call, or None for all records
+            
+        Returns:
+            Feed result with 'data' and 'toVersion', or None if failed
+        """
+        try:
+            logger.debug("Calling Geotab GetFeed for AddInData from version %s", from_version)
+            return self.geotab_api.call("GetFeed", typeName="AddInData", fromVersion=from_version,
+                                        search={'whereClause': self.ADD_IN_DATA_WHERE})
+        except mygeotab.exceptions.AuthenticationException:
+            raise
+        except Exception as e:
+            if self.is_geotab_rejection(e):
+                logger.warning("Geotab rejected GetFeed for AddInData (%s); reloading the mapping every cycle", e.name)
+                self.add_in_data_feed_supported = False
+            else:
+                logger.error("Error calling Geotab GetFeed for AddInData: %s", e)
+            return None
+    
+    def get_geotab_sync_data(self) -> Tuple[List[Dict], List[Dict], bool]:
+        """
+        Get DeviceStatusInfo and AddInData from Geotab in a single ExecuteMultiCall request
+        
+        AddInData is read from the Geotab feed, so once the mapping is loaded only changed
+        records are returned. Falls back to separate calls if the multi-call fails, and to a
+        full AddInData Get for the cycle if the feed call fails.
         
         Returns:
-            Response JSON or None if failed
+            Tuple of (device status records, AddInData records, whether the AddInData records
+            are changes to apply on top of the cached mapping)
         """
-        print(f"Fetching Ruckit location updates for driver {ri_driver} with token {ri_token}")
-        headers = {
-            'Authorization': f'Token {ri_token}',
-            'Content-Type': 'application/json'
-        }
+        use_feed = self.add_in_data_feed_supported
+        from_version = self._mapping_version
+        if time.monotonic() - self._mapping_loaded_at >= self.MAPPING_FULL_REFRESH:
+            from_version = None
         
-        url = f"{self.URL_UPDATES}?driver={ri_driver}"
+        if use_feed:
+            # Unfiltered so records switched back to placeholders still arrive and get unmapped
+            add_in_data_call = ("GetFeed", {"typeName": "AddInData", "fromVersion": from_version,
+                                            "search": {"whereClause": self.ADD_IN_DATA_WHERE}})
+        elif self.add_in_data_filter_supported:
+            add_in_data_call = ("Get", {"typeName": "AddInData", "search": {"whereClause": self.ADD_IN_DATA_FILTERED_WHERE}})
+        else:
+            add_in_data_call = ("Get", {"typeName": "AddInData", "search": {"whereClause": self.ADD_IN_DATA_WHERE}})
         
         try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Ruckit API returned status {response.status_code} for driver {ri_driver}")
-                return None
-        except requests.exceptions.RequestException as e:
-            print(f"Ruckit API request failed for driver {ri_driver}: {e}")
-            return None
+            logger.debug("Calling Geotab API for DeviceStatusInfo and AddInData (multi-call)")
+            device_status_list, add_in_data_result = self.geotab_api.multi_call([
+                ("Get", {"typeName": "DeviceStatusInfo"}),
+                add_in_data_call
+            ])
+            if use_feed:
+                self._add_in_data_feed_failures = 0
+            elif self.add_in_data_filter_supported:
+                self._add_in_data_filter_failures = 0
+        except mygeotab.exceptions.AuthenticationException:
+            raise
+        except Exception as e:
+            logger.warning("Geotab multi-call failed, falling back to separate calls: %s", e)
+            # The two calls are independent, so overlap their round-trips on two threads
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                device_status_future = executor.submit(self.get_device_status_info)
+                if use_feed:
+                    add_in_data_future = executor.submit(self.get_add_in_data_feed, from_version)
+                else:
+                    add_in_data_future = executor.submit(self.get_add_in_data)
+                device_status_list = device_status_future.result()
+                add_in_data_result = add_in_data_future.result()
+            if use_feed and add_in_data_result is not None:
+                self._add_in_data_feed_failures = 0
+        
+        if use_feed and add_in_data_result is None:
+            # Feed failed this cycle (get_add_in_data_feed disables it right away only if Geotab
+            # rejected it); reload the full mapping instead
+            add_in_data_result = self.get_add_in_data()
+            use_feed = False
+            if self.add_in_data_feed_supported and add_in_data_result is not None:
+                self._add_in_data_feed_failures += 1
+                if self._add_in_data_feed_failures >= self.GEOTAB_UNSUPPORTED_AFTER:
+                    logger.warning("AddInData GetFeed failed %d cycles in a row while Get worked; "
+                                   "reloading the mapping every cycle", self._add_in_data_feed_failures)
+                    self.add_in_data_feed_supported = False
+        
+        if use_feed:
+            self._mapping_version = add_in_data_result.get('toVersion')
+            if from_version is None:
+                self._mapping_loaded_at = time.monotonic()
+            return device_status_list or [], add_in_data_result.get('data') or [], from_version is not None
+        
+        self._mapping_version = None
+        return device_status_list or [], add_in_data_result or [], False
     
-    def extract_coordinates(self, location_data: Dict) -> Optional[Tuple[float, float]]:
+    def get_ruckit_headers(self, ri_token: str) -> Dict[str, str]:
         """
-        Extract coordinates from location data
+        Get the Ruckit request headers for a token, built once per token
         
         Args:
-            location_data: Location object from API response
+            ri_token: Ruckit API token
             
         Returns:
-            Tuple of (longitude, latitude) or None if not found
+            Headers dict (Content-Type is set on the session)
         """
-        try:
-            if 'coordinates' in location_data:
-                coords = location_data['coordinates']
-                if len(coords) >= 2:
-                    return (coords[0], coords[1])  # longitude, latitude
-        except (KeyError, IndexError, TypeError):
-            pass
-        return None
+        headers = self._header_cache.get(ri_token)
+        if headers is None:
+            headers = {'Authorization': f'Token {ri_token}'}
+            self._header_cache[ri_token] = headers
+        return headers
     
-    def coordinates_match(self, coord1: Tuple[float, float], coord2: Tuple[float, float], tolerance: float = 0.0001) -> bool:
+    async def get_ruckit_location_updates(self, ri_token: str, ri_driver: str) -> Optional[Dict]:
         """
-        Check if two coordinate pairs match within tolerance
+        Get the latest location update for a driver from Ruckit API
         
         Args:
-            coord1: First coordinate pair (longitude, latitude)
-            coord2: Second coordinate pair (longitude, latitude)
-            tolerance: Tolerance for coordinate comparison
-            
+            ri_token: Ruckit API token
+            ri_driver: Ruckit driver ID
+        
         Returns:
-            True if coordinates match within tolerance
+            Response JSON or None if failed
         """
-        if not coord1 or not coord2:
-            return False
+        logger.debug("Fetching Ruckit location updates for driver %s", ri_driver)
+        headers = self.get_ruckit_headers(ri_token)
+        
+        # Ask Ruckit for newest-first ordering so the first page holds the latest update. No page_size:
+        # if the endpoint honoured it but ignored ordering, one row in default order could be stale.
+        url = f"{self.URL_UPDATES}?driver={ri_driver}&ordering=-date"
         
-        lon_diff = abs(coord1[0] - coord2[0])
-        lat_diff = abs(coord1[1] - coord2[1])
+        for attempt in range(self.RUCKIT_MAX_RETRIES + 1):
+            try:
+                async with self.ruckit_semaphore, self.session.get(url, headers=headers) as response:
+                    if response.status == 200:
+                        # Decode the raw body with orjson rather than aiohttp's text decode + stdlib json
+                        return orjson.loads(await response.read())
+                    if response.status not in self.RUCKIT_RETRY_STATUSES or attempt == self.RUCKIT_MAX_RETRIES:
+                        logger.warning("Ruckit API returned status %s for driver %s", response.status, ri_driver)
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.RUCKIT_MAX_RETRIES:
+                    logger.warning("Ruckit API request failed for driver %s: %s", ri_driver, e)
+                    return None
+            
+            # Exponential backoff before retrying a transient failure
+            await asyncio.sleep(self.RUCKIT_RETRY_BACKOFF * (2 ** attempt))
+    
+    def extract_coordinates(self, location_data: Dict) -> Optional[Tuple[float, float]]:
+        """
+        Extract coordinates from location data
         
-        return lon_diff <= tolerance and lat_diff <= tolerance
+        Args:
+            location_data: Location object from API response
+            
+        Returns:
+            Tuple of (longitude, latitude) or None if not found
+        """
+        coords = location_data.get('coordinates') if isinstance(location_data, dict) else None
+        if isinstance(coords, (list, tuple)) and len(coords) >= 2:
+            return (coords[0], coords[1])  # longitude, latitude
+        return None
     
-    def post_location_update_to_ruckit(self, ri_token: str, ri_device: str, ri_driver: str, device_id: str, geotab_location_data: Dict):
+    async def post_location_update_to_ruckit(self, ri_token: str, ri_device: str, ri_driver: str, device_id: str, geotab_location_data: Dict):
         """
         Post location update to Ruckit API using Geotab coordinates
         
@@ -149,24 +367,22 @@ class LocationSyncScheduler:
             device_id: Geotab device ID
             geotab_location_data: Geotab location data containing latitude and longitude
         """
-        headers = {
-            'Authorization': f'Token {ri_token}',
-            'Content-Type': 'application/json'
-        }
+        headers = self.get_ruckit_headers(ri_token)
         
         # Extract coordinates from Geotab location data
         geotab_lat = geotab_location_data.get('latitude')
         geotab_lon = geotab_location_data.get('longitude') 
         
         if geotab_lat is None or geotab_lon is None:
-            print(f"Missing coordinates in Geotab data for device {device_id}")
+            logger.warning("Missing coordinates in Geotab data for device %s", device_id)
             return None
         
-        payload = json.dumps({
+        # orjson serializes datetime natively (ISO 8601) and returns bytes, which aiohttp sends as-is
+        payload = orjson.dumps({
             'truck': ri_device,
             'driver': ri_driver,
             'device_id': device_id,
-            'date': datetime.now().isoformat(),
+            'date': datetime.now(),
             'location': {
                 'type': 'Point',
                 'coordinates': [geotab_lon, geotab_lat]  # Using Geotab coordinates
@@ -179,56 +395,108 @@ class LocationSyncScheduler:
             'accuracy': None
         })
         
-        print(f"Payload to send to Ruckit: {payload}")
+        logger.debug("Payload to send to Ruckit: %s", payload)
         
         try:
-            response = requests.post(self.URL_UPDATES, headers=headers, data=payload)
-            print(f"POST to Ruckit: {response.status_code} for device {ri_device}")
-            if response.status_code in [200, 201]:
-                print(f"Successfully posted location update for device {ri_device}")
-                return response.json()
-            else:
-                print(f"Ruckit API error response: {response.text}")
-                return None
+            async with self.ruckit_semaphore, self.session.post(self.URL_UPDATES, headers=headers, data=payload) as response:
+                logger.debug("POST to Ruckit: %s for device %s", response.status, ri_device)
+                if response.status in [200, 201]:
+                    logger.info("Successfully posted location update for device %s", ri_device)
+                    # Drop the cached Ruckit location so the next cycle sees the new update
+                    self._ruckit_cache.pop(ri_driver, None)
+                    return await response.json()
+                else:
+                    logger.error("Ruckit API error response (%s) for device %s: %s", response.status, ri_device, await response.text())
+                    return None
         except Exception as e:
-            print(f"Error posting to Ruckit for device {ri_device}: {e}")
+            logger.error("Error posting to Ruckit for device %s: %s", ri_device, e)
             return None
-            
-    def is_placeholder_value(self, value: str) -> bool:
+    
+    async def fetch_ruckit_coordinates(self, device_id: str, ruckit_info: Dict,
+                                       geotab_coords: Tuple[float, float]) -> Optional[Tuple[float, float]]:
         """
-        Check if a value is a placeholder that should be skipped
+        Get the latest Ruckit coordinates for a mapped Geotab device
+        
+        Skips the Ruckit request when the cached Ruckit position still matches Geotab.
         
         Args:
-            value: The value to check
+            device_id: Geotab device ID
+            ruckit_info: Ruckit mapping (ri_device, ri_token, ri_driver) for this device
+            geotab_coords: Current Geotab (longitude, latitude) for this device
             
         Returns:
-            True if the value is a placeholder
+            Tuple of (longitude, latitude) or None if unavailable
         """
-        if not isinstance(value, str):
-            return False
+        try:
+            fetched_at, cached_coords = self._ruckit_cache.get(ruckit_info['ri_driver'], (0.0, None))
+            if (cached_coords is not None
+                    and time.monotonic() - fetched_at < self.RUCKIT_CACHE_TTL
+                    and abs(cached_coords[0] - geotab_coords[0]) <= self.COORDINATE_TOLERANCE
+                    and abs(cached_coords[1] - geotab_coords[1]) <= self.COORDINATE_TOLERANCE):
+                logger.debug("Geotab still matches cached Ruckit coords for device %s", device_id)
+                return cached_coords
+            
+            # Get latest location from Ruckit
+            ruckit_response = await self.get_ruckit_location_updates(
+                ruckit_info['ri_token'], 
+                ruckit_info['ri_driver']
+            )
+            
+            if not ruckit_response or 'results' not in ruckit_response:
+                logger.debug("No Ruckit location data for device %s", device_id)
+                return None
+            
+            results = ruckit_response['results']
+            if not results:
+                logger.debug("Empty results from Ruckit for device %s", device_id)
+                return None
+            
+            # Pick the latest date client-side too, in case the endpoint ignores ordering
+            latest_update = max(results, key=lambda x: x.get('date', ''))
+            location_obj = latest_update.get('location', {})
+            
+            ruckit_coords = self.extract_coordinates(location_obj)
+            if not ruckit_coords:
+                logger.debug("Could not extract coordinates from Ruckit data for device %s", device_id)
+                return None
+            
+            logger.debug("Ruckit coords for device %s: %s (updated %s)", device_id, ruckit_coords, latest_update.get('date'))
+            
+            # Coerce here so one malformed record can't break the batched comparison
+            ruckit_coords = (float(ruckit_coords[0]), float(ruckit_coords[1]))
+            self._ruckit_cache[ruckit_info['ri_driver']] = (time.monotonic(), ruckit_coords)
+            return ruckit_coords
         
-        placeholder_values = {'TOKEN', 'DriverID', 'DeviceID'}
-        return value in placeholder_values
+        except Exception as e:
+            logger.error("Error processing device %s: %s", device_id, e)
+            return None
     
-    def process_location_sync(self):
-        """Main processing function to sync locations between Geotab and Ruckit"""
-        print(f"\n=== Starting location sync process at {datetime.now()} ===")
+    async def process_location_sync(self) -> Optional[int]:
+        """
+        Main processing function to sync locations between Geotab and Ruckit
+        
+        Returns:
+            Number of discrepancies found, or None if the sync failed or no devices were compared
+        """
+        logger.info("=== Starting location sync process at %s ===", datetime.now())
         
         try:
-            # Get device status info from Geotab
-            device_status_list = self.get_device_status_info()
-            print(f"Retrieved {len(device_status_list)} device status records from Geotab")
+            # Get device status info and AddInData (contains Ruckit mapping) from Geotab in one request
+            device_status_list, add_in_data_list, is_delta = await self.run_blocking(self.get_geotab_sync_data)
+            logger.info("Retrieved %d device status records and %d %sAddInData records from Geotab",
+                        len(device_status_list), len(add_in_data_list), "changed " if is_delta else "")
             
-            # Get AddInData from Geotab (contains Ruckit mapping)
-            add_in_data_list = self.get_add_in_data()
-            print(f"Retrieved {len(add_in_data_list)} AddInData records from Geotab")
-            
-            # Create mapping from gt-device to Ruckit info
-            device_mapping = {}
+            # Update the cached mapping from gt-device to Ruckit info
+            if not is_delta:
+                self._mapping_entries = {}
             skipped_records = 0
             
             for add_in_data in add_in_data_list:
                 try:
+                    # A changed record replaces its previous mapping, if it still yields one
+                    record_id = add_in_data.get('id')
+                    self._mapping_entries.pop(record_id, None)
+                    
                     # Extract data from the details object
                     details = add_in_data.get('details', {})
                     
@@ -239,163 +507,232 @@ class LocationSyncScheduler:
                     
                     # Check if all required fields are present
                     if not all([gt_device, ri_device, ri_token, ri_driver]):
-                        print(f"Incomplete AddInData record - gt_device: {gt_device}, ri_device: {ri_device}, ri_token present: {bool(ri_token)}, ri_driver: {ri_driver}")
+                        logger.debug("Incomplete AddInData record - gt_device: %s, ri_device: %s, ri_token present: %s, ri_driver: %s",
+                                     gt_device, ri_device, bool(ri_token), ri_driver)
                         continue
                     
                     # Check if any values are placeholders
-                    if (self.is_placeholder_value(ri_token) or 
-                        self.is_placeholder_value(ri_driver) or 
-                        self.is_placeholder_value(ri_device)):
-                        print(f"Skipping AddInData record with placeholder values - gt_device: {gt_device}, ri_device: {ri_device}, ri_token: {ri_token}, ri_driver: {ri_driver}")
+                    if not self.PLACEHOLDER_VALUES.isdisjoint((ri_token, ri_driver, ri_device)):
+                        logger.debug("Skipping AddInData record with placeholder values - gt_device: %s, ri_device: %s, ri_token: %s, ri_driver: %s",
+                                     gt_device, ri_device, ri_token, ri_driver)
                         skipped_records += 1
                         continue
                     
-                    device_mapping[gt_device] = {
+                    self._mapping_entries[record_id] = (gt_device, {
                         'ri_device': ri_device,
                         'ri_token': ri_token,
                         'ri_driver': ri_driver
-                    }
-                    print(f"Mapped device {gt_device} to Ruckit driver {ri_driver}")
+                    })
+                    logger.debug("Mapped device %s to Ruckit driver %s", gt_device, ri_driver)
                         
                 except Exception as e:
-                    print(f"Error processing AddInData record: {e}")
+                    logger.warning("Error processing AddInData record: %s", e)
                     continue
             
-            print(f"Created mapping for {len(device_mapping)} devices (skipped {skipped_records} placeholder records)")
+            if add_in_data_list or not is_delta:
+                self.device_mapping = {gt_device: ruckit_info for gt_device, ruckit_info in self._mapping_entries.values()}
+                
+                # Drop cached Ruckit positions for drivers that are no longer mapped
+                mapped_drivers = {ruckit_info['ri_driver'] for ruckit_info in self.device_mapping.values()}
+                for ri_driver in self._ruckit_cache.keys() - mapped_drivers:
+                    del self._ruckit_cache[ri_driver]
+            device_mapping = self.device_mapping
             
-            # Process each device status record
-            discrepancies_found = 0
+            logger.info("Mapping covers %d devices (skipped %d placeholder records this cycle)", len(device_mapping), skipped_records)
             
+            # Keep only mapped devices that report a position, flattened to the fields the sync uses.
+            # Bound methods are hoisted into locals so the per-device loops skip attribute lookups.
+            get_mapping = device_mapping.get
+            filtered = []
+            append = filtered.append
             for device_status in device_status_list:
-                try:
-                    # Extract Geotab device info
-                    device_id = device_status.get('device', {}).get('id')
-                    geotab_lat = device_status.get('latitude')
-                    geotab_lon = device_status.get('longitude')
-                    
-                    if not all([device_id, geotab_lat is not None, geotab_lon is not None]):
-                        print(f"Skipping device with incomplete data: {device_id}")
-                        continue
-                    
-                    geotab_coords = (geotab_lon, geotab_lat)
-                    print(f"\nProcessing device {device_id} - Geotab coords: {geotab_coords}")
-                    
-                    # Check if we have Ruckit mapping for this device
-                    if device_id not in device_mapping:
-                        print(f"No Ruckit mapping found for device {device_id}")
-                        continue
-                    
-                    ruckit_info = device_mapping[device_id]
-                    
-                    # Get latest location from Ruckit
-                    ruckit_response = self.get_ruckit_location_updates(
-                        ruckit_info['ri_token'], 
-                        ruckit_info['ri_driver']
-                    )
-                    
-                    if not ruckit_response or 'results' not in ruckit_response:
-                        print(f"No Ruckit location data for device {device_id}")
-                        continue
-                    
-                    results = ruckit_response['results']
-                    if not results:
-                        print(f"Empty results from Ruckit for device {device_id}")
-                        continue
-                    
-                    # Get the most recent location update
-                    latest_update = max(results, key=lambda x: x.get('date', ''))
-                    location_obj = latest_update.get('location', {})
-                    
-                    ruckit_coords = self.extract_coordinates(location_obj)
-                    if not ruckit_coords:
-                        print(f"Could not extract coordinates from Ruckit data for device {device_id}")
-                        continue
-                    
-                    print(f"Ruckit coords: {ruckit_coords}")
-                    print(f"Latest update date: {latest_update.get('date')}")
-                    
-                    # Compare coordinates
-                    if not self.coordinates_match(geotab_coords, ruckit_coords):
-                        print(f"DISCREPANCY FOUND for device {device_id}!")
-                        print(f"  Geotab: {geotab_coords}")
-                        print(f"  Ruckit: {ruckit_coords}")
-                        
-                        # Call the POST function
-                        self.post_location_update_to_ruckit(
-                            ruckit_info['ri_token'],
-                            ruckit_info['ri_device'],
-                            ruckit_info['ri_driver'],
-                            device_id,
-                            device_status 
-                        )
-                        
-                        discrepancies_found += 1
-                    else:
-                        print(f"Coordinates match for device {device_id}")
-                
-                except Exception as e:
-                    print(f"Error processing device {device_id}: {e}")
+                device_id = (device_status.get('device') or {}).get('id')
+                ruckit_info = get_mapping(device_id)
+                if ruckit_info is None:
                     continue
+                geotab_lat = device_status.get('latitude')
+                geotab_lon = device_status.get('longitude')
+                if geotab_lat is not None and geotab_lon is not None:
+                    append((device_id, geotab_lat, geotab_lon, device_status, ruckit_info))
+            
+            logger.info("Syncing %d mapped devices with location data (skipped %d unmapped or incomplete)",
+                        len(filtered), len(device_status_list) - len(filtered))
+            
+            # Fetch the latest Ruckit position for every device concurrently
+            fetch = self.fetch_ruckit_coordinates
+            tasks = [
+                fetch(device_id, ruckit_info, (geotab_lon, geotab_lat))
+                for device_id, geotab_lat, geotab_lon, _, ruckit_info in filtered
+            ]
+            fetched = await asyncio.gather(*tasks, return_exceptions=True)
             
-            print(f"\n=== Sync completed. Found {discrepancies_found} discrepancies ===")
+            # Pair each Geotab record with its Ruckit coordinates, dropping devices without any
+            compared = [(record, coords) for record, coords in zip(filtered, fetched) if isinstance(coords, tuple)]
+            
+            if not compared:
+                # Nothing was compared (Geotab/Ruckit returned no usable data), so this says nothing
+                # about whether locations match
+                logger.info("=== Sync completed. No devices could be compared ===")
+                return None
+            
+            # Compare all (longitude, latitude) pairs in one vectorized pass
+            geotab_coords = np.array([(lon, lat) for (_, lat, lon, _, _), _ in compared], dtype=np.float64)
+            ruckit_coords = np.array([coords for _, coords in compared], dtype=np.float64)
+            mismatches = np.any(np.abs(geotab_coords - ruckit_coords) > self.COORDINATE_TOLERANCE, axis=1)
+            
+            post = self.post_location_update_to_ruckit
+            post_tasks = []
+            for index in np.nonzero(mismatches)[0]:
+                (device_id, geotab_lat, geotab_lon, device_status, ruckit_info), coords = compared[index]
+                logger.info("DISCREPANCY FOUND for device %s! Geotab: %s, Ruckit: %s",
+                            device_id, (geotab_lon, geotab_lat), coords)
+                
+                post_tasks.append(post(
+                    ruckit_info['ri_token'],
+                    ruckit_info['ri_device'],
+                    ruckit_info['ri_driver'],
+                    device_id,
+                    device_status
+                ))
             
+            await asyncio.gather(*post_tasks, return_exceptions=True)
+            discrepancies_found = len(post_tasks)
+            logger.info("Coordinates match for %d devices", len(compared) - discrepancies_found)
+            
+            logger.info("=== Sync completed. Found %d discrepancies ===", discrepancies_found)
+            return discrepancies_found
+            
+        except mygeotab.exceptions.AuthenticationException:
+            raise
         except Exception as e:
-            print(f"Error in location sync process: {e}")
+            logger.error("Error in location sync process: %s", e)
+            return None
     
     def scheduler_loop(self):
-        """Main scheduler loop that runs every 2 minutes"""
-        print("Location sync scheduler started. Running every 2 minutes...")
+        """Thread entry point that runs the async scheduler on its own event loop"""
+        asyncio.run(self.async_scheduler_loop())
+    
+    async def wait_for_next_sync(self, delay: float):
+        """
+        Sleep until the next sync, returning early if stop() is called
         
-        while self.running:
-            try:
-                if not self.authenticate_geotab():
-                    print("Failed to authenticate with Geotab. Retrying in 2 minutes...")
-                    time.sleep(120)  # 2 minutes
-                    continue
-                
-                # Process location sync
-                self.process_location_sync()
-                
-                # Wait for 2 minutes
-                if self.running:
-                    print(f"Waiting 2 minutes until next sync...")
-                    time.sleep(120)  # 2 minutes
+        Args:
+            delay: Seconds to wait
+        """
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def async_scheduler_loop(self):
+        """Main scheduler loop that polls at an adaptive interval"""
+        logger.info("Location sync scheduler started. Running every %d-%d seconds...",
+                    self.SYNC_INTERVAL_MIN, self.SYNC_INTERVAL_MAX)
+        
+        self._scheduler_loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        
+        # One pooled keep-alive session for all Ruckit calls, created inside the running event loop.
+        # The semaphore caps in-flight requests; the connector's per-host limit mirrors it.
+        self.ruckit_semaphore = asyncio.Semaphore(self.RUCKIT_MAX_CONCURRENCY)
+        self.session = aiohttp.ClientSession(
+            headers={'Content-Type': 'application/json'},
+            timeout=self.RUCKIT_TIMEOUT,
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=self.RUCKIT_MAX_CONCURRENCY, ttl_dns_cache=300)
+        )
+        
+        interval = self.SYNC_INTERVAL
+        try:
+            while self.running:
+                try:
+                    cycle_start = time.monotonic()
                     
-            except Exception as e:
-                print(f"Error in scheduler loop: {e}")
-                time.sleep(120)  # Wait 2 minutes before retrying
+                    # Process location sync, reusing the Geotab session from start()
+                    try:
+                        discrepancies_found = await self.process_location_sync()
+                    except mygeotab.exceptions.AuthenticationException:
+                        logger.warning("Geotab session rejected. Re-authenticating...")
+                        if not await self.run_blocking(self.authenticate_geotab):
+                            logger.error("Failed to authenticate with Geotab. Retrying in %d seconds...", self.SYNC_INTERVAL)
+                            await self.wait_for_next_sync(self.SYNC_INTERVAL)
+                            continue
+                        discrepancies_found = await self.process_location_sync()
+                    
+                    # Poll sooner while locations drift, back off only after a cycle that compared
+                    # devices and found them all matching; a failed or empty cycle resets the interval
+                    if discrepancies_found is None:
+                        interval = self.SYNC_INTERVAL
+                    elif discrepancies_found:
+                        interval = self.SYNC_INTERVAL_MIN
+                    else:
+                        interval = min(self.SYNC_INTERVAL_MAX, interval * 2)
+                    
+                    # Wait out the rest of the interval, net of the time the cycle took
+                    if self.running:
+                        delay = max(0, interval - (time.monotonic() - cycle_start))
+                        logger.info("Waiting %.0f seconds until next sync...", delay)
+                        await self.wait_for_next_sync(delay)
+                        
+                except Exception as e:
+                    logger.error("Error in scheduler loop: %s", e)
+                    await self.wait_for_next_sync(self.SYNC_INTERVAL)  # Wait before retrying
+        finally:
+            await self.session.close()
+            self.session = None
+            self.ruckit_semaphore = None
+            self._stop_event = None
+            self._scheduler_loop = None
     
     def start(self):
         """Start the scheduler"""
         if self.running:
-            print("Scheduler is already running!")
+            logger.warning("Scheduler is already running!")
+            return
+        
+        # The session and semaphore belong to the previous thread's event loop until it exits
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            logger.warning("Previous scheduler is still finishing its sync cycle. Try again shortly.")
             return
         
         # Initial authentication
         if not self.authenticate_geotab():
-            print("Failed to authenticate with Geotab. Cannot start scheduler.")
+            logger.error("Failed to authenticate with Geotab. Cannot start scheduler.")
             return
         
         self.running = True
         self.scheduler_thread = threading.Thread(target=self.scheduler_loop, daemon=True)
         self.scheduler_thread.start()
-        print("Scheduler started successfully!")
+        logger.info("Scheduler started successfully!")
     
     def stop(self):
         """Stop the scheduler"""
         if not self.running:
-            print("Scheduler is not running!")
+            logger.warning("Scheduler is not running!")
             return
         
-        print("Stopping scheduler...")
+        logger.info("Stopping scheduler...")
         self.running = False
         
+        # Wake the scheduler if it is waiting for the next sync
+        loop, stop_event = self._scheduler_loop, self._stop_event
+        if loop is not None and stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(stop_event.set)
+            except RuntimeError:
+                pass  # Loop already closed; the thread is exiting
+        
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
+            if self.scheduler_thread.is_alive():
+                logger.warning("Scheduler is finishing its current sync cycle and will exit after it.")
+                return
         
-        print("Scheduler stopped.")
+        logger.info("Scheduler stopped.")
 
 if __name__ == "__main__":
+    # Per-device detail is logged at DEBUG; set level=logging.DEBUG to see it
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    
     # Load environment variables
     load_dotenv()
     
@@ -405,7 +742,7 @@ if __name__ == "__main__":
     GEOTAB_PASSWORD = os.getenv("GEOTAB_PASSWORD")
     
     if not all([GEOTAB_USERNAME, GEOTAB_DATABASE, GEOTAB_PASSWORD]):
-        print("Error: Missing required environment variables. Please check your .env file.")
+        logger.error("Missing required environment variables. Please check your .env file.")
         exit(1)
     
     # Create and start the scheduler
@@ -424,6 +761,6 @@ if __name__ == "__main__":
             time.sleep(1)
             
     except KeyboardInterrupt:
-        print("\nReceived interrupt signal...")
+        logger.info("Received interrupt signal...")
         scheduler.stop()
-        print("Program exited cleanly.")
\ No newline at end of file
+        logger.info("Program exited cleanly.")
\ No newline at end of file